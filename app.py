@@ -17,10 +17,16 @@ SQLite database.
 
 import os
 import time
+import asyncio
+import logging
 import math
 import sqlite3
-from typing import Dict, List
+import threading
+import uuid
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
 
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
@@ -36,6 +42,15 @@ RETENTION_HOURS = int(os.getenv("RETENTION_HOURS", "0"))
 # allowed CORS origins; multiple origins may be comma separated
 _cors = os.getenv("CORS_ORIGINS", "").split(",") if os.getenv("CORS_ORIGINS") else []
 ORIGINS = [o.strip() for o in _cors if o.strip()]
+# optional Redis URL; when set, rooms are shared between workers/hosts
+REDIS_URL = os.getenv("REDIS_URL", "")
+# prefix for every Redis key and pub/sub channel used by the app
+REDIS_PREFIX = "townsquare:"
+# identifies this worker's entries in the shared users lists
+WORKER_ID = uuid.uuid4().hex
+# seconds before a shared users list entry that is no longer refreshed
+# (e.g. its worker crashed) drops out
+PRESENCE_TTL = 60
 
 # generic circles: age ranges and interest groups
 AGE_CIRCLES: List[str] = [
@@ -61,6 +76,8 @@ DB_PATH = BASE_DIR / "square.db"
 
 # ---- App setup ----
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="Town Square")
 
 # configure CORS if origins are provided
@@ -79,13 +96,43 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 
 # ---- Database helpers ----
 
+# A single connection is shared for the lifetime of the process.  It runs
+# in autocommit mode with WAL journaling, so each insert is a cheap append
+# to the write-ahead log rather than a full connect + fsync.
+_CON: Optional[sqlite3.Connection] = None
+_DB_LOCK = threading.Lock()
+
+# Messages are not written from the websocket loop.  ``db_save`` enqueues
+# them and a background flusher writes them in batches, one transaction
+# per batch.  The queue and stop event belong to the running event loop,
+# so they are created on startup.
+_write_q: "Optional[asyncio.Queue[tuple]]" = None
+WRITE_QUEUE_SIZE = 10000
+FLUSH_MAX_ROWS = 500
+FLUSH_MAX_DELAY = 0.05  # seconds
+# set on shutdown; the flusher exits once the queue is empty
+_flush_stop: Optional[asyncio.Event] = None
+# how long shutdown waits for the background tasks to finish
+SHUTDOWN_TIMEOUT = 5.0  # seconds
+# expired messages are pruned by a background task, not on every read
+PRUNE_INTERVAL = 3600  # seconds
+
+
 def db_init() -> None:
     """Initialise the SQLite database if message retention is enabled."""
+    global _CON
     if RETENTION_HOURS <= 0:
         return
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.cursor()
-        cur.execute(
+    _CON = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    with _DB_LOCK:
+        # incremental auto-vacuum lets the pruner hand freed pages back to
+        # the OS; an existing database only switches over after a VACUUM
+        if _CON.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            _CON.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            _CON.execute("VACUUM")
+        _CON.execute("PRAGMA journal_mode=WAL")
+        _CON.execute("PRAGMA synchronous=NORMAL")
+        _CON.execute(
             """
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -97,96 +144,515 @@ def db_init() -> None:
             )
             """
         )
-        cur.execute(
+        _CON.execute(
             "CREATE INDEX IF NOT EXISTS idx_room_circle_ts ON messages(room, circle, ts)"
         )
-        con.commit()
 
 
 def db_save(room: str, circle: str, nick: str, text: str, ts: int) -> None:
-    """Persist a message to SQLite when retention is enabled."""
-    if RETENTION_HOURS <= 0:
+    """Queue a message for persistence when retention is enabled."""
+    if _CON is None:
         return
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            "INSERT INTO messages(room, circle, nick, text, ts) VALUES(?,?,?,?,?)",
-            (room, circle, nick, text, ts),
-        )
-        con.commit()
+    if _write_q is None:
+        logger.warning("Message writer not running, message from %s not persisted", nick)
+        return
+    row = (room, circle, nick, text, ts)
+    try:
+        _write_q.put_nowait(row)
+    except asyncio.QueueFull:
+        # never write from the event loop; losing history beats stalling chat
+        logger.warning("Write queue full, message from %s not persisted", nick)
+
+
+def _db_write_batch(rows: List[tuple]) -> None:
+    """Insert a batch of message rows inside a single transaction."""
+    with _DB_LOCK:
+        _CON.execute("BEGIN")
+        try:
+            _CON.executemany(
+                "INSERT INTO messages(room, circle, nick, text, ts) VALUES(?,?,?,?,?)",
+                rows,
+            )
+        except Exception:
+            _CON.execute("ROLLBACK")
+            raise
+        _CON.execute("COMMIT")
+
+
+def _drain_write_queue(q: "asyncio.Queue[tuple]", limit: int) -> List[tuple]:
+    """Pop up to ``limit`` rows that are already waiting in the queue."""
+    rows: List[tuple] = []
+    while len(rows) < limit:
+        try:
+            row = q.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if row is not None:  # skip the shutdown wake-up sentinel
+            rows.append(row)
+    return rows
+
+
+async def _flusher(q: "asyncio.Queue[tuple]", stop: asyncio.Event) -> None:
+    """Background task that writes queued messages in batches.
+
+    It is stopped with ``stop`` rather than cancelled, so rows it has
+    taken off the queue are always written.
+    """
+    while not (stop.is_set() and q.empty()):
+        try:
+            first = await q.get()
+            if first is None:  # woken up by stop_db_tasks
+                continue
+            if not stop.is_set() and q.qsize() < FLUSH_MAX_ROWS - 1:
+                # let a burst of messages pile up into one transaction
+                await asyncio.sleep(FLUSH_MAX_DELAY)
+            rows = [first] + _drain_write_queue(q, FLUSH_MAX_ROWS - 1)
+            try:
+                await asyncio.to_thread(_db_write_batch, rows)
+            except Exception:  # keep flushing later batches
+                logger.exception("Failed to persist %d messages", len(rows))
+        except Exception:
+            # never let the writer die silently; back off and keep going
+            logger.exception("Message writer failed")
+            await asyncio.sleep(FLUSH_MAX_DELAY)
 
 
 def db_recent(room: str, circle: str, limit: int = 50) -> List[tuple]:
     """Fetch recent messages for a room/circle pair from SQLite."""
-    if RETENTION_HOURS <= 0:
+    if _CON is None:
         return []
     cutoff = int(time.time()) - RETENTION_HOURS * 3600
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.cursor()
-        # prune old messages
-        cur.execute("DELETE FROM messages WHERE ts < ?", (cutoff,))
-        cur.execute(
+    with _DB_LOCK:
+        rows = _CON.execute(
             """
             SELECT nick, text, ts FROM messages
             WHERE room = ? AND circle = ? AND ts >= ?
             ORDER BY ts DESC LIMIT ?
             """,
             (room, circle, cutoff, limit),
-        )
-        rows = cur.fetchall()
+        ).fetchall()
     # return in ascending order of timestamp (oldest first) for display
     return list(reversed(rows))
 
 
+def db_prune() -> None:
+    """Delete messages older than the retention window and reclaim free pages."""
+    cutoff = int(time.time()) - RETENTION_HOURS * 3600
+    with _DB_LOCK:
+        _CON.execute("DELETE FROM messages WHERE ts < ?", (cutoff,))
+        # execute() only steps the pragma once (freeing a single page);
+        # executescript() runs it to completion
+        _CON.executescript("PRAGMA incremental_vacuum(1000);")
+
+
+async def _pruner() -> None:
+    """Background task that prunes expired messages periodically."""
+    while True:
+        try:
+            await asyncio.to_thread(db_prune)
+        except Exception:  # try again next interval
+            logger.exception("Failed to prune messages")
+        await asyncio.sleep(PRUNE_INTERVAL)
+
+
 # initialise database if needed
 db_init()
 
-# ---- User tracking for active users ----
-# Map each room key ("room::circle") to a dictionary of WebSocket connections
-# and their associated nicknames.  This allows us to broadcast the list of
-# active users to everyone in the room whenever someone joins or leaves.
-room_users: Dict[str, Dict[WebSocket, str]] = {}
+
+@app.on_event("startup")
+async def start_db_tasks() -> None:
+    """Start the background writer and pruner when retention is enabled."""
+    global _write_q, _flush_stop
+    if _CON is None:
+        return
+    _write_q = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    _flush_stop = asyncio.Event()
+    app.state.db_tasks = [
+        asyncio.create_task(_flusher(_write_q, _flush_stop)),
+        asyncio.create_task(_pruner()),
+    ]
+
+
+@app.on_event("shutdown")
+async def stop_db_tasks() -> None:
+    """Stop background tasks and flush any messages still queued."""
+    global _write_q, _flush_stop
+    tasks = getattr(app.state, "db_tasks", [])
+    app.state.db_tasks = []
+    if tasks:
+        flusher, pruner = tasks
+        pruner.cancel()
+        _flush_stop.set()
+        try:
+            _write_q.put_nowait(None)  # wake the flusher if it is idle
+        except asyncio.QueueFull:
+            pass  # it is busy and checks _flush_stop after each batch
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(flusher, pruner, return_exceptions=True),
+                SHUTDOWN_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Database tasks did not stop within %ss", SHUTDOWN_TIMEOUT)
+    if _CON is None:
+        return
+    if _write_q is not None:
+        rows = _drain_write_queue(_write_q, _write_q.qsize())
+        if rows:
+            _db_write_batch(rows)
+    _write_q = _flush_stop = None
+    with _DB_LOCK:
+        _CON.execute("PRAGMA optimize")
 
 
 # ---- WebSocket connection management ----
 
+# maximum number of outbound messages buffered per client; when a burst
+# overflows it the oldest queued message is discarded
+OUTBOX_SIZE = 32
+# a client whose current send has not completed within this many seconds
+# is considered stalled and dropped
+SEND_STALL_TIMEOUT = 10.0
+
+
+class ClientChannel:
+    """A connected client plus the queue and task that relay messages to it.
+
+    Broadcasting only puts messages on each client's queue; the relay task
+    does the actual socket write, so one slow client cannot hold up the
+    rest of the room.  ``nick`` is set once the client has joined and is
+    what appears in the room's active users list.  ``sending_since`` is
+    when the send in progress started, or ``None`` between sends.
+    """
+
+    __slots__ = ("ws", "nick", "queue", "task", "sending_since")
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.ws = websocket
+        self.nick: Optional[str] = None
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self.sending_since: Optional[float] = None
+        self.task = asyncio.create_task(self._relay())
+
+    async def _relay(self) -> None:
+        try:
+            while True:
+                payload = await self.queue.get()
+                self.sending_since = time.monotonic()
+                await self.ws.send_text(payload)
+                self.sending_since = None
+        except Exception:
+            # the socket is gone; broadcast notices the finished task
+            pass
+
+    @property
+    def alive(self) -> bool:
+        return not self.task.done()
+
+    def stalled(self, now: float) -> bool:
+        """Whether the send in progress has been stuck for too long."""
+        return (
+            self.sending_since is not None
+            and now - self.sending_since > SEND_STALL_TIMEOUT
+        )
+
+    async def close(self) -> None:
+        """Stop relaying and close the underlying socket."""
+        self.task.cancel()
+        try:
+            await self.ws.close()
+        except Exception:
+            pass
+
+
 class ConnectionManager:
-    """Track active WebSocket connections for each room."""
+    """Track active WebSocket connections for each room.
+
+    By default everything lives in this process.  When ``REDIS_URL`` is
+    set, :meth:`start` connects to Redis: broadcasts are published to a
+    channel per room, each worker subscribes only to the rooms it has
+    local clients in and relays what it receives to them, and the active
+    users list is kept in a Redis sorted set so it covers clients on all
+    workers.
+    """
 
     def __init__(self) -> None:
-        # key is "room::circle"; value is list of WebSocket connections
-        self.rooms: Dict[str, List[WebSocket]] = {}
+        # key is "room::circle"; value is the set of client channels
+        self.rooms: Dict[str, Set[ClientChannel]] = {}
+        # fire-and-forget tasks (closing sockets, unsubscribing); referenced
+        # until done
+        self._background: Set[asyncio.Task] = set()
+        self.redis = None
+        self._pubsub = None
+        # set once the pubsub has a channel for the listener to read
+        self._subscribed: Optional[asyncio.Event] = None
+        # serialises SUBSCRIBE/UNSUBSCRIBE on the shared pubsub connection
+        self._sub_lock: Optional[asyncio.Lock] = None
+        # Redis subscriber and presence heartbeat
+        self._tasks: List[asyncio.Task] = []
 
     def key(self, room: str, circle: str) -> str:
-        return f"{room.lower()}::{circle.lower()}"
+        # room and circle are already normalised by normalize_name
+        return f"{room}::{circle}"
+
+    # -- Redis backend --
+
+    async def start(self, url: str) -> None:
+        """Connect to Redis and start relaying published room messages."""
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._subscribed = asyncio.Event()
+        self._sub_lock = asyncio.Lock()
+        # rooms that already have local clients
+        for k in self.rooms:
+            await self._subscribe(k)
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self.redis is not None:
+            await self.redis.aclose()
+
+    def _room_channel(self, k: str) -> str:
+        return f"{REDIS_PREFIX}room:{k}"
+
+    async def _subscribe(self, k: str) -> None:
+        """Start receiving room ``k``'s messages from other workers."""
+        try:
+            async with self._sub_lock:
+                await self._pubsub.subscribe(self._room_channel(k))
+            self._subscribed.set()
+        except Exception:
+            logger.exception("Failed to subscribe to room %s", k)
+
+    async def _unsubscribe(self, k: str) -> None:
+        """Stop receiving room ``k``'s messages once no local client is left."""
+        try:
+            async with self._sub_lock:
+                if k in self.rooms:  # someone joined again in the meantime
+                    return
+                await self._pubsub.unsubscribe(self._room_channel(k))
+        except Exception:
+            logger.exception("Failed to unsubscribe from room %s", k)
+
+    async def _listen(self) -> None:
+        """Relay messages published by any worker to local clients."""
+        prefix = REDIS_PREFIX + "room:"
+        while True:
+            if not self._pubsub.subscribed:
+                # nothing to read until a local client joins a room
+                self._subscribed.clear()
+                await self._subscribed.wait()
+                continue
+            try:
+                # ends by itself once the last room is unsubscribed
+                async for msg in self._pubsub.listen():
+                    self._deliver(msg["channel"][len(prefix):], msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the pubsub reconnects and resubscribes on the next read
+                logger.exception("Redis subscriber failed, retrying")
+                await asyncio.sleep(1)
 
-    async def connect(self, room: str, circle: str, websocket: WebSocket) -> None:
-        await websocket.accept()
-        k = self.key(room, circle)
-        self.rooms.setdefault(k, []).append(websocket)
+    async def _heartbeat(self) -> None:
+        """Keep this worker's users fresh in the shared lists.
+
+        Presence entries are scored with the time they were last
+        refreshed and ignored once older than ``PRESENCE_TTL``, so users
+        of a worker that died without cleaning up disappear on their own.
+        """
+        while True:
+            await asyncio.sleep(PRESENCE_TTL / 3)
+            now = time.time()
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for k, conns in list(self.rooms.items()):
+                        key = self._presence_key(k)
+                        members = {
+                            self._presence_member(ch): now for ch in conns if ch.nick
+                        }
+                        if members:
+                            pipe.zadd(key, members)
+                        pipe.zremrangebyscore(key, "-inf", now - PRESENCE_TTL)
+                        pipe.expire(key, PRESENCE_TTL)
+                    await pipe.execute()
+            except Exception:
+                logger.exception("Failed to refresh presence in Redis")
+
+    def _presence_key(self, k: str) -> str:
+        return f"{REDIS_PREFIX}users:{k}"
+
+    def _presence_member(self, ch: ClientChannel) -> str:
+        # the nickname comes last so it may itself contain ":"
+        return f"{WORKER_ID}:{id(ch)}:{ch.nick}"
 
-    def disconnect(self, room: str, circle: str, websocket: WebSocket) -> None:
+    # -- membership --
+
+    async def connect(self, room: str, circle: str, websocket: WebSocket) -> ClientChannel:
+        await websocket.accept()
         k = self.key(room, circle)
-        if k in self.rooms and websocket in self.rooms[k]:
-            self.rooms[k].remove(websocket)
-            if not self.rooms[k]:
-                self.rooms.pop(k, None)
+        ch = ClientChannel(websocket)
+        new_room = k not in self.rooms
+        self.rooms.setdefault(k, set()).add(ch)
+        if new_room and self.redis is not None:
+            await self._subscribe(k)
+        return ch
+
+    def disconnect(self, room: str, circle: str, ch: ClientChannel) -> None:
+        self.disconnect_by_key(self.key(room, circle), ch)
+
+    def disconnect_by_key(self, k: str, ch: ClientChannel) -> None:
+        ch.task.cancel()
+        conns = self.rooms.get(k)
+        if conns is None:
+            return
+        conns.discard(ch)
+        if not conns:
+            self.rooms.pop(k, None)
+            if self.redis is not None:
+                self._spawn(self._unsubscribe(k))
+
+    def _spawn(self, coro) -> None:
+        """Run ``coro`` in the background, keeping a reference until done."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def set_nick(self, k: str, ch: ClientChannel, nick: str) -> None:
+        """Record the nickname shown for a connection in the users list."""
+        old = self._presence_member(ch) if ch.nick else None
+        ch.nick = nick
+        if self.redis is None:
+            return
+        key = self._presence_key(k)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if old:
+                    pipe.zrem(key, old)
+                pipe.zadd(key, {self._presence_member(ch): time.time()})
+                pipe.expire(key, PRESENCE_TTL)
+                await pipe.execute()
+        except Exception:
+            logger.exception("Failed to update presence in Redis")
+
+    async def leave(self, k: str, ch: ClientChannel) -> None:
+        """Remove a connection and tell the rest of the room if it had joined."""
+        self.disconnect_by_key(k, ch)
+        if not ch.nick:
+            return
+        if self.redis is not None:
+            try:
+                await self.redis.zrem(self._presence_key(k), self._presence_member(ch))
+            except Exception:
+                logger.exception("Failed to remove presence from Redis")
+        elif not self.rooms.get(k):
+            # nobody left in this process to tell
+            return
+        await self.broadcast_users(k)
+
+    async def users(self, k: str) -> List[str]:
+        """Return the nicknames of everyone who has joined the room ``k``."""
+        if self.redis is not None:
+            try:
+                members = await self.redis.zrangebyscore(
+                    self._presence_key(k), time.time() - PRESENCE_TTL, "+inf"
+                )
+            except Exception:
+                # fall back to the users connected to this worker
+                logger.exception("Failed to read presence from Redis")
+            else:
+                return sorted(m.split(":", 2)[2] for m in members)
+        return sorted(ch.nick for ch in self.rooms.get(k, ()) if ch.nick)
+
+    # -- broadcasting --
+
+    async def broadcast_users(self, k: str) -> None:
+        """Send the current active users list to everyone in the room ``k``."""
+        user_list = await self.users(k)
+        await self.broadcast_by_key(k, {
+            "type": "users",
+            "users": user_list,
+            "count": len(user_list),
+        })
 
     async def broadcast(self, room: str, circle: str, message: dict) -> None:
-        """Send a message to all clients in a room and remove dead connections."""
-        k = self.key(room, circle)
-        dead: List[WebSocket] = []
-        for ws in self.rooms.get(k, []):
+        """Queue a message for all clients in a room and drop dead or slow ones."""
+        await self.broadcast_by_key(self.key(room, circle), message)
+
+    async def broadcast_by_key(self, k: str, message: dict) -> None:
+        """Like :meth:`broadcast`, for a key already built with :meth:`key`."""
+        # encode once and share the same string with every client
+        payload = orjson.dumps(message).decode()
+        if self.redis is not None:
             try:
-                await ws.send_json(message)
+                await self.redis.publish(self._room_channel(k), payload)
+                return
             except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(room, circle, ws)
+                # still reach the clients connected to this worker
+                logger.exception("Redis publish failed, delivering locally only")
+        self._deliver(k, payload)
+
+    def _deliver(self, k: str, payload: str) -> None:
+        """Queue an encoded message for the local clients of room ``k``.
+
+        A full queue alone does not mean a client is slow: many broadcasts
+        in one loop step (e.g. everyone rejoining after a restart) fill it
+        before any relay runs.  Only clients whose relay has died or whose
+        current send has stalled are dropped; otherwise the oldest queued
+        message makes room for the new one.
+        """
+        now = time.monotonic()
+        dead: List[ClientChannel] = []
+        for ch in self.rooms.get(k, []):
+            if not ch.alive:
+                dead.append(ch)
+                continue
+            try:
+                ch.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                if ch.stalled(now):
+                    dead.append(ch)
+                    continue
+                ch.queue.get_nowait()
+                ch.queue.put_nowait(payload)
+        if not dead:
+            return
+        for ch in dead:
+            self.disconnect_by_key(k, ch)
+        # closing makes each client's receive loop run its disconnect cleanup
+        self._spawn(self._close_all(dead))
+
+    async def _close_all(self, channels: List[ClientChannel]) -> None:
+        """Close several client sockets concurrently."""
+        await asyncio.gather(*(ch.close() for ch in channels), return_exceptions=True)
 
 
 manager = ConnectionManager()
 
 
+@app.on_event("startup")
+async def start_pubsub() -> None:
+    """Switch the connection manager to Redis when ``REDIS_URL`` is set."""
+    if REDIS_URL:
+        await manager.start(REDIS_URL)
+
+
+@app.on_event("shutdown")
+async def stop_pubsub() -> None:
+    await manager.stop()
+
+
 # ---- Pydantic model ----
 
 class Post(BaseModel):
@@ -197,23 +663,25 @@ class Post(BaseModel):
 # ---- Utility functions ----
 
 def sanitize(s: str) -> str:
-    """Trim and truncate to a reasonable length (for nicknames, circles, etc.)."""
-    return (s or "").strip()[:200]
+    """Trim and truncate to a reasonable length (for nicknames, circles, etc.).
 
+    Anything that is not a string (e.g. a number in a JSON frame) becomes ``""``.
+    """
+    if not s or not isinstance(s, str):
+        return ""
+    if len(s) <= 200:
+        return s.strip()
+    return s.strip()[:200]
 
-def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate the great‑circle distance between two points on Earth."""
-    R = 6371.0  # kilometres
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(math.radians(lat1))
-        * math.cos(math.radians(lat2))
-        * math.sin(dlon / 2) ** 2
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+
+@lru_cache(maxsize=1024)
+def normalize_name(s: str) -> str:
+    """Normalise a room or circle name from a URL: lowercase, underscores, sanitized.
+
+    Room and circle names repeat across page loads and reconnects, so
+    results are cached.
+    """
+    return sanitize(s.lower().replace(" ", "_"))
 
 
 def room_bucket(lat: float, lon: float, precision: int = 3) -> str:
@@ -245,6 +713,44 @@ def neighbor_buckets(lat: float, lon: float, step: float = 0.001) -> List[tuple[
     return rooms
 
 
+def _central_angle(a: float) -> float:
+    """Return the central angle for the haversine term ``a``.
+
+    Equivalent to ``2 * atan2(sqrt(a), sqrt(1 - a))`` with one square root
+    and one inverse-trig call.  ``a`` is in [0, 1] up to rounding, so it
+    is clamped to keep near-antipodal points inside asin's domain.
+    """
+    return 2 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+@lru_cache(maxsize=8)
+def _half_step_sin2(step: float) -> float:
+    """Return ``sin²(step / 2)`` for a bucket step given in degrees."""
+    return math.sin(math.radians(step) / 2) ** 2
+
+
+def neighbor_distances(lat: float, step: float = 0.001) -> List[float]:
+    """Distances in km from ``lat`` to each bucket of :func:`neighbor_buckets`.
+
+    The offsets to the neighbouring buckets are fixed multiples of
+    ``step``, so the haversine terms that depend only on the offset are
+    cached and longitude drops out entirely.  Only one cosine per bucket
+    row is left to compute.  The result is in the same order as
+    :func:`neighbor_buckets`.
+    """
+    R = 6371.0  # kilometres
+    h = _half_step_sin2(step)
+    cos1 = math.cos(math.radians(lat))
+    dists: List[float] = []
+    for di in (-1, 0, 1):
+        dlat_term = h if di else 0.0
+        cos12 = cos1 * math.cos(math.radians(lat + di * step))
+        for dj in (-1, 0, 1):
+            a = dlat_term + (cos12 * h if dj else 0.0)
+            dists.append(R * _central_angle(a))
+    return dists
+
+
 # ---- Routes ----
 
 @app.get("/health")
@@ -264,8 +770,8 @@ def index(request: Request) -> HTMLResponse:
 
 @app.get("/square/{room}/{circle}", response_class=HTMLResponse)
 def square_page(request: Request, room: str, circle: str) -> HTMLResponse:
-    room = sanitize(room.lower().replace(" ", "_"))
-    circle = sanitize(circle.lower().replace(" ", "_"))
+    room = normalize_name(room)
+    circle = normalize_name(circle)
     history = db_recent(room, circle, limit=50)
     return templates.TemplateResponse(
         "square.html",
@@ -280,32 +786,39 @@ def square_page(request: Request, room: str, circle: str) -> HTMLResponse:
 
 @app.websocket("/ws/{room}/{circle}")
 async def ws_square(websocket: WebSocket, room: str, circle: str) -> None:
-    room = sanitize(room)
-    circle = sanitize(circle)
-    await manager.connect(room, circle, websocket)
+    room = normalize_name(room)
+    circle = normalize_name(circle)
+    channel = await manager.connect(room, circle, websocket)
+    k = manager.key(room, circle)
     try:
         while True:
-            data = await websocket.receive_json()
+            # read the raw frame so orjson can parse it as-is (str or bytes)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            raw = message.get("bytes")
+            if raw is None:
+                raw = message.get("text") or ""
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                continue
             # Handle a join event.  The client sends {"join": nickname} once upon connection
             if "join" in data:
+                # register nickname for this connection
                 nick = sanitize(data.get("join", "anon")) or "anon"
-                key = manager.key(room, circle)
-                # register nickname for this websocket
-                room_users.setdefault(key, {})[websocket] = nick
+                await manager.set_nick(k, channel, nick)
                 # broadcast updated user list (type: users)
-                user_list = list(room_users[key].values())
-                await manager.broadcast(room, circle, {
-                    "type": "users",
-                    "users": user_list,
-                    "count": len(user_list),
-                })
+                await manager.broadcast_users(k)
                 continue
 
             # Handle typing notifications
             if data.get("type") == "typing":
                 nick = sanitize(data.get("nick", "anon")) or "anon"
                 # broadcast typing status to all clients
-                await manager.broadcast(room, circle, {
+                await manager.broadcast_by_key(k, {
                     "type": "typing",
                     "nick": nick,
                     "typing": bool(data.get("typing")),
@@ -317,34 +830,20 @@ async def ws_square(websocket: WebSocket, room: str, circle: str) -> None:
             text = sanitize(data.get("text", ""))
             if not text:
                 continue
-            key = manager.key(room, circle)
-            # update stored nickname for this websocket (in case it changed)
-            room_users.setdefault(key, {})[websocket] = nick
             ts = int(time.time())
             db_save(room, circle, nick, text, ts)
             msg = {"nick": nick, "text": text, "ts": ts}
-            await manager.broadcast(room, circle, msg)
-            # broadcast updated user list after message (ensures list stays fresh)
-            user_list = list(room_users[key].values())
-            await manager.broadcast(room, circle, {
-                "type": "users",
-                "users": user_list,
-                "count": len(user_list),
-            })
+            await manager.broadcast_by_key(k, msg)
+            # the users list only needs resending if the nickname changed
+            if nick != channel.nick:
+                await manager.set_nick(k, channel, nick)
+                await manager.broadcast_users(k)
     except WebSocketDisconnect:
-        # remove connection from connection manager and user tracking
-        manager.disconnect(room, circle, websocket)
-        key = manager.key(room, circle)
-        if key in room_users and websocket in room_users[key]:
-            room_users[key].pop(websocket, None)
-            # Only broadcast updated users list if there are other connections
-            if manager.rooms.get(key):
-                user_list = list(room_users[key].values())
-                await manager.broadcast(room, circle, {
-                    "type": "users",
-                    "users": user_list,
-                    "count": len(user_list),
-                })
+        pass
+    finally:
+        # remove connection (and with it the nickname) from the room, even
+        # if the handler failed
+        await manager.leave(k, channel)
 
 
 @app.get("/api/rooms")
@@ -357,13 +856,15 @@ def api_rooms(lat: float, lon: float) -> dict:
     """
     # compute centre id
     centre_id = room_bucket(lat, lon)
+    step = 0.001  # degrees between neighbouring buckets
+    buckets = neighbor_buckets(lat, lon, step=step)
     rooms = []
-    for rid, rlat, rlon in neighbor_buckets(lat, lon):
+    for (rid, rlat, rlon), dist in zip(buckets, neighbor_distances(lat, step=step)):
         rooms.append({
             "id": rid,
             "lat": rlat,
             "lon": rlon,
-            "distance_km": round(haversine(lat, lon, rlat, rlon), 2),
+            "distance_km": round(dist, 2),
             "is_center": rid == centre_id,
         })
     rooms.sort(key=lambda x: (not x["is_center"], x["distance_km"]))
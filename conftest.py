@@ -0,0 +1,3 @@
+# Having a conftest.py at the repository root makes pytest put this
+# directory on sys.path, so the tests can ``import app`` whether they are
+# run with ``pytest`` or ``python -m pytest``.
@@ -0,0 +1,89 @@
+"""Tests for per-client relaying and dropping in ``ConnectionManager``."""
+
+import asyncio
+
+import orjson
+
+import app
+
+
+class FakeWebSocket:
+    """Records what is sent; ``block`` makes every send hang forever."""
+
+    def __init__(self, block: bool = False) -> None:
+        self.block = block
+        self.sent: list = []
+        self.closed = False
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, payload: str) -> None:
+        if self.block:
+            await asyncio.Event().wait()
+        self.sent.append(orjson.loads(payload))
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_join_storm_keeps_every_client():
+    async def scenario():
+        manager = app.ConnectionManager()
+        k = manager.key("r", "c")
+        sockets = [FakeWebSocket() for _ in range(app.OUTBOX_SIZE + 8)]
+        # everyone (re)joins within a single loop step, as after a restart
+        for ws in sockets:
+            ch = await manager.connect("r", "c", ws)
+            await manager.set_nick(k, ch, f"user{len(manager.rooms[k])}")
+            await manager.broadcast_users(k)
+        await asyncio.sleep(0.05)
+        return manager, k, sockets
+
+    manager, k, sockets = asyncio.run(scenario())
+    assert len(manager.rooms[k]) == len(sockets)
+    for ws in sockets:
+        assert not ws.closed
+        # the newest users list always gets through
+        assert ws.sent[-1]["count"] == len(sockets)
+
+
+def test_stalled_client_is_dropped(monkeypatch):
+    monkeypatch.setattr(app, "SEND_STALL_TIMEOUT", 0.05)
+
+    async def scenario():
+        manager = app.ConnectionManager()
+        k = manager.key("r", "c")
+        healthy, stuck = FakeWebSocket(), FakeWebSocket(block=True)
+        await manager.connect("r", "c", healthy)
+        await manager.connect("r", "c", stuck)
+        await manager.broadcast_by_key(k, {"text": "first"})
+        await asyncio.sleep(0.1)  # the stuck relay is now mid-send
+        for i in range(app.OUTBOX_SIZE + 1):
+            await manager.broadcast_by_key(k, {"text": str(i)})
+        await asyncio.sleep(0.05)
+        return manager, k, healthy, stuck
+
+    manager, k, healthy, stuck = asyncio.run(scenario())
+    assert [ch.ws for ch in manager.rooms[k]] == [healthy]
+    assert stuck.closed and not healthy.closed
+    # the burst overflowed the healthy queue by one, so only "0" is lost
+    assert [m["text"] for m in healthy.sent] == ["first"] + [
+        str(i) for i in range(1, app.OUTBOX_SIZE + 1)
+    ]
+
+
+def test_full_queue_drops_oldest_message_not_client():
+    async def scenario():
+        manager = app.ConnectionManager()
+        k = manager.key("r", "c")
+        ws = FakeWebSocket()
+        await manager.connect("r", "c", ws)
+        for i in range(app.OUTBOX_SIZE + 5):
+            await manager.broadcast_by_key(k, {"n": i})
+        await asyncio.sleep(0.05)
+        return ws
+
+    ws = asyncio.run(scenario())
+    assert not ws.closed
+    assert [m["n"] for m in ws.sent] == list(range(5, app.OUTBOX_SIZE + 5))
@@ -0,0 +1,89 @@
+"""Tests for the write-behind message store used when retention is enabled."""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture
+def retention_db(tmp_path, monkeypatch):
+    """Enable retention against a throwaway database."""
+    monkeypatch.setattr(app, "RETENTION_HOURS", 1)
+    monkeypatch.setattr(app, "DB_PATH", tmp_path / "square.db")
+    monkeypatch.setattr(app, "_CON", None)
+    app.db_init()
+    yield
+    app._CON.close()
+
+
+def send_chat(client: TestClient, *texts: str) -> None:
+    with client.websocket_connect("/ws/r/c") as ws:
+        for text in texts:
+            ws.send_text(f'{{"nick":"alice","text":"{text}"}}')
+        # the sender gets its own message back once it was processed
+        for _ in texts:
+            ws.receive_text()
+
+
+def wait_for_history(expected: int, timeout: float = 2.0) -> list:
+    deadline = time.monotonic() + timeout
+    while True:
+        rows = app.db_recent("r", "c")
+        if len(rows) >= expected or time.monotonic() > deadline:
+            return rows
+        time.sleep(0.01)
+
+
+def test_history_persists_after_flush(retention_db):
+    with TestClient(app.app) as client:
+        send_chat(client, "one", "two")
+        rows = wait_for_history(2)
+        assert [text for _, text, _ in rows] == ["one", "two"]
+        assert client.get("/square/r/c").text.count("two") >= 1
+
+
+def test_writer_runs_in_every_lifespan(retention_db):
+    with TestClient(app.app) as client:
+        send_chat(client, "first")
+        assert len(wait_for_history(1)) == 1
+    with TestClient(app.app) as client:
+        send_chat(client, "second")
+        # written by the flusher while the app is still running
+        assert len(wait_for_history(2)) == 2
+        assert not app.app.state.db_tasks[0].done()
+
+
+def test_shutdown_drains_queue(retention_db, monkeypatch):
+    async def idle_flusher(q, stop):
+        # leave everything in the queue for stop_db_tasks to write
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(app, "_flusher", idle_flusher)
+    with TestClient(app.app) as client:
+        send_chat(client, *[f"m{i}" for i in range(20)])
+        assert app.db_recent("r", "c") == []
+    assert len(app.db_recent("r", "c")) == 20
+
+
+def test_flusher_survives_unexpected_errors(retention_db, monkeypatch, caplog):
+    calls = []
+    real_drain = app._drain_write_queue
+
+    def flaky_drain(q, limit):
+        calls.append(limit)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return real_drain(q, limit)
+
+    monkeypatch.setattr(app, "_drain_write_queue", flaky_drain)
+    with TestClient(app.app) as client:
+        send_chat(client, "lost")
+        send_chat(client, "kept")
+        assert [text for _, text, _ in wait_for_history(1)] == ["kept"]
+        assert not app.app.state.db_tasks[0].done()
+    assert "Message writer failed" in caplog.text
@@ -0,0 +1,64 @@
+"""Parity checks for the asin-based haversine used by ``/api/rooms``."""
+
+import math
+
+import pytest
+
+from app import _central_angle, neighbor_buckets, neighbor_distances
+
+R = 6371.0  # kilometres
+
+
+def haversine_atan2(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Reference great-circle distance using the original atan2 form."""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dlat / 2) ** 2
+        + math.cos(math.radians(lat1))
+        * math.cos(math.radians(lat2))
+        * math.sin(dlon / 2) ** 2
+    )
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+@pytest.mark.parametrize("a", [0.0, 1e-12, 1e-6, 0.25, 0.5, 0.75, 1 - 1e-12, 1.0])
+def test_central_angle_matches_atan2_form(a):
+    expected = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    assert _central_angle(a) == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+def test_central_angle_clamps_rounding_above_one():
+    # antipodal points can round a just above 1; asin would raise ValueError
+    assert _central_angle(1.0 + 1e-15) == pytest.approx(math.pi)
+
+
+@pytest.mark.parametrize(
+    "lat1, lon1, lat2, lon2",
+    [(0.0, 0.0, 0.0, 180.0), (10.0, 20.0, -10.0, -160.0), (89.9, 45.0, -89.9, -135.0)],
+)
+def test_central_angle_near_antipodal_points(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dlat / 2) ** 2
+        + math.cos(math.radians(lat1))
+        * math.cos(math.radians(lat2))
+        * math.sin(dlon / 2) ** 2
+    )
+    expected = haversine_atan2(lat1, lon1, lat2, lon2)
+    # asin is ill-conditioned next to 1, so allow centimetres of drift here
+    assert R * _central_angle(a) == pytest.approx(expected, abs=1e-3)
+
+
+@pytest.mark.parametrize(
+    "lat, lon",
+    [(0.0, 0.0), (40.7128, -74.006), (-33.8688, 151.2093), (64.1466, -21.9426), (89.99, 10.0)],
+)
+@pytest.mark.parametrize("step", [0.001, 0.01])
+def test_neighbor_distances_match_atan2_haversine(lat, lon, step):
+    buckets = neighbor_buckets(lat, lon, step=step)
+    dists = neighbor_distances(lat, step=step)
+    assert len(dists) == len(buckets) == 9
+    for (_, rlat, rlon), dist in zip(buckets, dists):
+        assert dist == pytest.approx(haversine_atan2(lat, lon, rlat, rlon), abs=1e-9)
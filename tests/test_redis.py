@@ -0,0 +1,70 @@
+"""Tests for the Redis backend, run against an in-process fakeredis."""
+
+import asyncio
+
+import orjson
+import pytest
+
+import app
+
+fakeredis = pytest.importorskip("fakeredis")
+aioredis = pytest.importorskip("redis.asyncio")
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.sent: list = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, payload: str) -> None:
+        self.sent.append(orjson.loads(payload))
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        aioredis,
+        "from_url",
+        lambda url, **kw: fakeredis.aioredis.FakeRedis(server=server, **kw),
+    )
+
+
+def test_workers_subscribe_only_to_their_rooms(fake_redis):
+    async def scenario():
+        w1, w2 = app.ConnectionManager(), app.ConnectionManager()
+        await w1.start("redis://fake")
+        await w2.start("redis://fake")
+        shared, other = w1.key("r", "c"), w1.key("elsewhere", "c")
+        a, b, c = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await w1.connect("r", "c", a)
+        cb = await w2.connect("r", "c", b)
+        await w1.connect("elsewhere", "c", c)
+
+        subscribed = set(w2._pubsub.channels)
+        assert subscribed == {w2._room_channel(shared)}
+
+        await w1.broadcast_by_key(shared, {"text": "hello"})
+        await w1.broadcast_by_key(other, {"text": "not for w2"})
+        await asyncio.sleep(0.1)
+        assert a.sent == b.sent == [{"text": "hello"}]
+        assert c.sent == [{"text": "not for w2"}]
+
+        # the last local client leaving drops the subscription
+        w2.disconnect_by_key(shared, cb)
+        await asyncio.sleep(0.1)
+        assert not w2._pubsub.channels
+        await w1.broadcast_by_key(shared, {"text": "after"})
+        await asyncio.sleep(0.1)
+        assert b.sent == [{"text": "hello"}]
+        assert a.sent[-1] == {"text": "after"}
+
+        await w1.stop()
+        await w2.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,73 @@
+"""End-to-end tests for the ``/ws/{room}/{circle}`` handler."""
+
+import time
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app.app) as c:
+        yield c
+
+
+def receive(ws) -> dict:
+    return orjson.loads(ws.receive_text())
+
+
+def wait_until_empty(timeout: float = 2.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while app.manager.rooms and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return app.manager.rooms
+
+
+def test_chat_round_trip(client):
+    with client.websocket_connect("/ws/R 1/Music") as a, client.websocket_connect("/ws/r_1/music") as b:
+        a.send_text('{"join":"alice"}')
+        assert receive(a)["users"] == ["alice"]
+        assert receive(b)["users"] == ["alice"]
+        b.send_bytes(b'{"nick":"bob","text":"hi"}')
+        for ws in (a, b):
+            msg = receive(ws)
+            assert (msg["nick"], msg["text"]) == ("bob", "hi")
+            assert receive(ws)["users"] == ["alice", "bob"]
+    assert wait_until_empty() == {}
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        "not json",
+        "[1, 2]",
+        '"text"',
+        "null",
+        '{"nick":"a","text":5}',
+        '{"nick":"a","text":["x"]}',
+        '{"nick":"a","text":"   "}',
+    ],
+)
+def test_malformed_frames_are_skipped(client, frame):
+    with client.websocket_connect("/ws/r/c") as ws:
+        ws.send_text(frame)
+        ws.send_text('{"nick":"a","text":"still here"}')
+        assert receive(ws)["text"] == "still here"
+    assert wait_until_empty() == {}
+
+
+@pytest.mark.parametrize("frame", ['{"join":5}', '{"join":null}', '{"join":{"a":1}}'])
+def test_non_string_join_falls_back_to_anon(client, frame):
+    with client.websocket_connect("/ws/r/c") as ws:
+        ws.send_text(frame)
+        assert receive(ws)["users"] == ["anon"]
+
+
+def test_non_string_nick_in_chat_falls_back_to_anon(client):
+    with client.websocket_connect("/ws/r/c") as ws:
+        ws.send_text('{"nick":7,"text":"hello"}')
+        msg = receive(ws)
+        assert (msg["nick"], msg["text"]) == ("anon", "hello")